@@ -9,6 +9,11 @@ from models.model import TD3, ReplayBuffer
 import sys
 from torch.utils.tensorboard import SummaryWriter
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 NUMBER_OF_ITERATIONS = 1000000
 MAX_LIMIT = 200
 START_TIMESTEPS = 5000
@@ -19,6 +24,32 @@ EPSILON = 1
 EPSILON_DECR = 0.001
 EPSILON_LOW = 0.025
 
+RNG = np.random.default_rng()
+NOISE_CHUNK = 1024
+
+
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True)
+    def _postprocess_action(action, noise, low, high):
+        """
+        Fuses the add + clip + int cast on the policy action into one pass
+        """
+        out = np.empty(action.shape[0], dtype=np.int32)
+        for i in range(action.shape[0]):
+            a = action[i] + noise[i]
+            if a < low:
+                a = low
+            elif a > high:
+                a = high
+            out[i] = np.int32(a)
+        return out
+else:
+    def _postprocess_action(action, noise, low, high):
+        """
+        Fuses the add + clip + int cast on the policy action into one pass
+        """
+        return (action + noise).clip(low, high).astype(np.int32)
+
 
 def is_greedy(t):
     global EPSILON
@@ -28,24 +59,30 @@ def is_greedy(t):
     return result
 
 
-def select_action(env, state, policy, t):
-    global STD_GAUSSIAN_EXPLORATION_NOISE
+def select_action(env, state_np, policy, t, noise):
     if t < START_TIMESTEPS or is_greedy(t):
-        action = env.action_space.sample()
+        action = RNG.integers(
+            -MAX_LIMIT, MAX_LIMIT + 1, size=env.action_space.shape, dtype=np.int32
+        )
     else:
-        action = (
-            policy.select_action(state.to_numpy())
-            + np.random.normal(
-                0,
-                MAX_LIMIT * STD_GAUSSIAN_EXPLORATION_NOISE,
-                size=(env.action_space.shape),
-            )
-        ).clip(-MAX_LIMIT, MAX_LIMIT)
-        action = action.astype(np.int32)
+        action = _postprocess_action(
+            policy.select_action(state_np).ravel(), noise, -MAX_LIMIT, MAX_LIMIT
+        )
 
     return action
 
 
+def sample_noise_chunk(action_dim):
+    """
+    Draws NOISE_CHUNK exploration-noise vectors in one vectorized call
+    """
+    return RNG.normal(
+        0,
+        MAX_LIMIT * STD_GAUSSIAN_EXPLORATION_NOISE,
+        size=(NOISE_CHUNK, action_dim),
+    ).astype(np.float32)
+
+
 def run(
     stock_names,
     start_date,
@@ -76,29 +113,43 @@ def run(
         policy.load(save_location)
     replay_buffer = ReplayBuffer(env.state.shape, env.action_space.shape[0])
     state, done = env.reset(), False
+    state_np = state.to_numpy()
     episode_reward = 0
     episode_timesteps = 0
     episode_num = 0
+    # hoist hot-loop lookups into locals (LOAD_FAST instead of LOAD_ATTR)
+    action_dim = env.action_space.shape[0]
+    max_epochs = env.max_epochs
+    env_step = env.step
+    buffer_add = replay_buffer.add_from_state
+    policy_train = policy.train
+    noise_block = sample_noise_chunk(action_dim)
+    # compile the fused postprocessing once, outside the hot loop
+    _postprocess_action(noise_block[0], noise_block[0], -MAX_LIMIT, MAX_LIMIT)
     with tqdm(total=NUMBER_OF_ITERATIONS, file=sys.stdout) as pbar:
         for t in range(NUMBER_OF_ITERATIONS):
             episode_timesteps += 1
+            noise_index = t % NOISE_CHUNK
+            if noise_index == 0 and t > 0:
+                noise_block = sample_noise_chunk(action_dim)
             # Select action randomly or according to policy
-            action = select_action(env, state, policy, t)
+            action = select_action(env, state_np, policy, t, noise_block[noise_index])
             # Perform action
-            next_state, reward, done = env.step(action.flatten())
-            if pbar.n % 10 == 0:
+            next_state, reward, done = env_step(action.flatten())
+            next_state_np = next_state.to_numpy()
+            if t % 500 == 0 and t > 0:
                 # utils.log_info(f"Date and Time: {env.get_date_and_time()}")
                 # utils.log_info(f"Current Portfolio Value: {env.calculate_portfolio_value()}")
                 pbar.set_description(
-                    f"{env.get_date_and_time()[0]} | R: {reward} | A: {action} | H: {env.get_holdings()}"
+                    f"{env.get_date_and_time()[0]} | R: {reward}"
+                    f" | A: {np.array2string(action, threshold=8)}"
+                    f" | H: {np.array2string(env.get_holdings(), threshold=8)}"
                 )
             if pbar.n % 200 == 0:
                 policy.save(save_location)
-            done_bool = float(done) if episode_timesteps < env.max_epochs else 0
+            done_bool = float(done) if episode_timesteps < max_epochs else 0
             # Store data in replay buffer
-            replay_buffer.add(
-                state.to_numpy(), action, next_state.to_numpy(), reward, done_bool
-            )
+            buffer_add(state_np, action, next_state, reward, done_bool)
             if t >= START_TIMESTEPS:
                 writer.add_scalars(
                     "holdings",
@@ -112,10 +163,11 @@ def run(
                 )
                 writer.add_scalar("reward", reward, t - START_TIMESTEPS)
             state = next_state
+            state_np = next_state_np
             episode_reward += reward
             # Train agent after collecting sufficient data
             if t >= START_TIMESTEPS:
-                policy.train(replay_buffer, BATCH_SIZE)
+                policy_train(replay_buffer, BATCH_SIZE)
             if done:
                 # +1 to account for 0 indexing. +0 on ep_timesteps since it will increment +1 even if done=True
                 # print(
@@ -123,6 +175,7 @@ def run(
                 # )
                 # Reset environment
                 state, done = env.reset(), False
+                state_np = state.to_numpy()
                 utils.log_info("episode_reward", episode_reward)
                 utils.log_info(
                     "reward per timestep", episode_reward / episode_timesteps
@@ -134,14 +187,12 @@ def run(
     return policy, replay_buffer
 
 
-def append_portfolio_value(df, env):
+def append_portfolio_value(values, timestamps, env):
     value = env.calculate_portfolio_value()
     date, time = env.get_date_and_time()
     time = "09:30AM" if time == "Open" else "04:00PM"
-    datetime = date + " " + time
-    return df.append(
-        pd.DataFrame([round(value, 2)], columns=["Portfolio Value"], index=[datetime])
-    )
+    values.append(round(value, 2))
+    timestamps.append(date + " " + time)
 
 
 def test(
@@ -162,8 +213,8 @@ def test(
     utils.log_info("Testing policy")
     state, done = env.reset(), False
     episode_reward = 0
-    df = pd.DataFrame(columns=["Portfolio Value"])
-    df = append_portfolio_value(df, env)
+    values, timestamps = [], []
+    append_portfolio_value(values, timestamps, env)
     utils.log_info("Testing...")
     while not done:
         # print(env.get_date_and_time())
@@ -175,7 +226,8 @@ def test(
         state = next_state
         episode_reward += reward
         # policy.train(replay_buffer, BATCH_SIZE)
-        df = append_portfolio_value(df, env)
+        append_portfolio_value(values, timestamps, env)
+    df = pd.DataFrame({"Portfolio Value": values}, index=timestamps)
     df.to_csv(save_location, index_label="Date")
 
 
@@ -5,8 +5,15 @@ import numpy as np
 from tqdm import tqdm
 from models.state import State
 import random
-import re
 import datetime
+import functools
+
+@functools.lru_cache(maxsize=8)
+def _load_valid_dates(path):
+    """
+    Loads and caches the set of valid trading dates from a price CSV
+    """
+    return frozenset(pd.read_csv(path, usecols=["Date"])["Date"].astype(str))
 
 class StockEnv(gym.Env):
     """
@@ -38,10 +45,10 @@ class StockEnv(gym.Env):
         """
         super(StockEnv, self).__init__()
         self.random_start = random_start
-        self.valid_dates = pd.read_csv("data/price_data/SPY.csv", index_col="Date").index
+        self.valid_dates = _load_valid_dates("data/price_data/SPY.csv")
         self.number_of_stocks = len(stock_names)
         self.stock_names = stock_names
-        self.initialize_date(start_date, end_date), "Date preconditions failed"
+        self.initialize_date(start_date, end_date)
         self.starting_amount_lower = starting_amount_lower
         self.starting_amount_upper = starting_amount_upper
         self.starting_amount = self.starting_amount_upper
@@ -52,18 +59,15 @@ class StockEnv(gym.Env):
         self.invalid_action_penalty = invalid_action_penalty
 
     def calculate_reward(self, holdings, remaining_money, stock_prices_new, action_is_invalid=False):
-        buy_hold_comparison = (self.state.buy_hold_comparison * stock_prices_new).sum()
+        buy_hold_comparison = np.dot(self.state.buy_hold_comparison, stock_prices_new)
         buy_hold_last = self.buy_hold_last
-        r = (
-            remaining_money
-            + np.sum(holdings * (stock_prices_new))
-        )
+        r = remaining_money + np.dot(holdings, stock_prices_new)
         value_last = self.value_at_last_timestep if self.value_at_last_timestep != 0 else r
 
         self.value_at_last_timestep = r
         self.buy_hold_last = buy_hold_comparison
-        if action_is_invalid:
-            r = r - self.invalid_action_penalty # can penalize invalid actions
+        # can penalize invalid actions; False contributes nothing
+        r = r - action_is_invalid * self.invalid_action_penalty
         return r - value_last
 
     def step(self, action):
@@ -90,20 +94,16 @@ class StockEnv(gym.Env):
         """
         Increments the date by one epoch
         """
-        incr = 1
-        start_arr = list(map(lambda x: int(x), re.split(r"[\-]", self.start_date)))
-        date_obj = datetime.date(start_arr[2], start_arr[0], start_arr[1])
-        s = self.stock_names[0]
-        adjusted_date = str(date_obj + datetime.timedelta((self.epochs + incr) // 2))
-        while not (
-            adjusted_date
-            in self.valid_dates
-        ):
-            incr += 1
-            adjusted_date = str(date_obj + datetime.timedelta((self.epochs + incr) // 2))
-            if incr >= 20:
-                raise Exception(f"{adjusted_date} is out of range")
-        self.epochs += incr
+        day = (self.epochs + 1) // 2
+        pos = np.searchsorted(self._valid_offsets, day)
+        if pos >= len(self._valid_offsets):
+            adjusted_date = str(self._start_date_obj + datetime.timedelta(int(day)))
+            raise Exception(f"{adjusted_date} is out of range")
+        offset = int(self._valid_offsets[pos])
+        if offset == day:
+            self.epochs += 1
+        else:
+            self.epochs = 2 * offset
 
     def is_done(self):
         """
@@ -144,10 +144,7 @@ class StockEnv(gym.Env):
         Gets current date and time
         """
         time = "Open" if self.epochs % 2 == 0 else "Close"
-        start_arr = list(map(lambda x: int(x), re.split(r"[\-]", self.start_date)))
-        date_obj = datetime.date(
-            start_arr[2], start_arr[0], start_arr[1]
-        ) + datetime.timedelta(self.epochs // 2)
+        date_obj = self._start_date_obj + datetime.timedelta(self.epochs // 2)
         return str(date_obj), time
 
     def calculate_portfolio_value(self):
@@ -164,36 +161,31 @@ class StockEnv(gym.Env):
 
     def initialize_date(self, start_date, end_date):
         """
-        Returns: True if start_date and end_date are in the right format.
-                False otherwise
-        """
-        start_arr = re.split(r"[\-]", start_date)
-        end_arr = re.split(r"[\-]", end_date)
-        date_is_valid = True
-        for x, y in zip(start_arr, end_arr):
-            date_is_valid = x.isdigit() and y.isdigit() and date_is_valid
-            if date_is_valid:
-                date_is_valid = date_is_valid and int(x) > 0 and int(y) > 0
-            else:
-                return date_is_valid
-        date1 = [int(x) for x in re.split(r"[\-]", start_date)]
-        date2 = [int(x) for x in re.split(r"[\-]", end_date)]
-        date1_obj = datetime.date(date1[2], date1[0], date1[1])
-        date2_obj = datetime.date(date2[2], date2[0], date2[1])
+        Validates start_date and end_date and caches the parsed start date.
+        Raises ValueError if either date is malformed or out of order
+        """
+        try:
+            date1_obj = datetime.datetime.strptime(start_date, "%m-%d-%Y").date()
+            date2_obj = datetime.datetime.strptime(end_date, "%m-%d-%Y").date()
+        except ValueError:
+            raise ValueError("Date is not valid")
         epochs = (date2_obj - date1_obj).days
-        if not (date_is_valid and epochs >= 0):
+        if epochs < 0:
             raise ValueError("Date is not valid")
         self.max_epochs = epochs * 2
         self.start_date = start_date
         self.end_date = end_date
+        self._start_date_obj = date1_obj
+        offsets = (pd.to_datetime(sorted(self.valid_dates)) - pd.Timestamp(date1_obj)).days
+        self._valid_offsets = np.asarray(offsets[offsets >= 0], dtype=np.int32)
 
     def initialize_starting_epoch(self, start_date, end_date):
         """
         Gets the starting epoch of a cycle
         """
         if self.random_start:
-            date1 = [int(x) for x in re.split(r"[\-]", start_date)]
-            date2 = [int(x) for x in re.split(r"[\-]", end_date)]
+            date1 = [int(x) for x in start_date.split("-")]
+            date2 = [int(x) for x in end_date.split("-")]
             date1_obj = datetime.date(date1[2], date1[0], date1[1])
             date2_obj = datetime.date(date2[2], date2[0], date2[1])
             self.epochs = random.randint(-1, int((date2_obj - date1_obj).days * 0.2))
@@ -1,4 +1,3 @@
-import copy
 import numpy as np
 import torch
 import torch.nn as nn
@@ -7,6 +6,7 @@ import utility.utils as utils
 from math import floor
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+torch.backends.cudnn.benchmark = True
 
 # Implementation of Twin Delayed Deep Deterministic Policy Gradients (TD3)
 # Paper: https://arxiv.org/abs/1802.09477
@@ -95,13 +95,19 @@ class CNN(nn.Module):
 
 
     def forward(self, X, X_immediate=None):
-        out = self.layers(X)   
-        out = self.flatten(out)
-        if X_immediate != None:
-            out2 = self.layers(X_immediate.unsqueeze(1))
-            out2 = self.flatten(out2)
-            out = self.output(torch.cat((out, out2), -1))
-        return out
+        if X_immediate is None:
+            return self.flatten(self.layers(X))
+        X_immediate = X_immediate.unsqueeze(1)
+        if X_immediate.shape[1:] == X.shape[1:]:
+            # both inputs run the same stack, so one batched pass halves
+            # the per-block launches; split the result back apart
+            batch = X.shape[0]
+            fused = self.flatten(self.layers(torch.cat((X, X_immediate), 0)))
+            out, out2 = fused[:batch], fused[batch:]
+        else:
+            out = self.flatten(self.layers(X))
+            out2 = self.flatten(self.layers(X_immediate))
+        return self.output(torch.cat((out, out2), -1))
         
 class Actor(nn.Module):
     def __init__(self, state_dim, action_dim, max_action):
@@ -183,10 +189,12 @@ class TD3(object):
         lr=3e-4,
     ):
         self.actor = Actor(state_dim, action_dim, max_action).to(device)
-        self.actor_target = copy.deepcopy(self.actor)
+        self.actor_target = Actor(state_dim, action_dim, max_action).to(device)
+        self.actor_target.load_state_dict(self.actor.state_dict())
         self.actor_optimizer = torch.optim.Adam(self.actor.parameters(), lr=lr)
         self.critic = Critic(state_dim, action_dim).to(device)
-        self.critic_target = copy.deepcopy(self.critic)
+        self.critic_target = Critic(state_dim, action_dim).to(device)
+        self.critic_target.load_state_dict(self.critic.state_dict())
         self.critic_optimizer = torch.optim.Adam(self.critic.parameters(), lr=lr)
         self.max_action = max_action
         self.discount = discount
@@ -195,9 +203,43 @@ class TD3(object):
         self.noise_clip = noise_clip
         self.policy_freq = policy_freq
         self.total_it = 0
+        self.use_amp = torch.cuda.is_available()
+        self.scaler = torch.cuda.amp.GradScaler(enabled=self.use_amp)
 
         self.actor_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(self.actor_optimizer, factor=0.5, patience=20,  verbose=True)
         self.critic_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(self.critic_optimizer, factor=0.5, patience=20,  verbose=True)
+        self.cache_param_lists()
+        self.compile_forwards()
+
+    def cache_param_lists(self):
+        """
+        Caches flat parameter lists so the soft target updates can run as
+        fused _foreach kernels instead of one copy per tensor.
+        """
+        self.actor_params = list(self.actor.parameters())
+        self.actor_target_params = list(self.actor_target.parameters())
+        self.critic_params = list(self.critic.parameters())
+        self.critic_target_params = list(self.critic_target.parameters())
+
+    def compile_forwards(self):
+        """
+        Wraps the hot forward passes in torch.compile when available so the
+        small Linear/PReLU chains fuse into fewer kernels. The compiled
+        wrappers share parameters with the plain modules, so checkpointing
+        and the soft target updates are unaffected.
+        """
+        if hasattr(torch, "compile"):
+            self.actor_fwd = torch.compile(self.actor)
+            self.actor_target_fwd = torch.compile(self.actor_target)
+            self.critic_fwd = torch.compile(self.critic)
+            self.critic_target_fwd = torch.compile(self.critic_target)
+            self.critic_q1_fwd = torch.compile(self.critic.Q1)
+        else:
+            self.actor_fwd = self.actor
+            self.actor_target_fwd = self.actor_target
+            self.critic_fwd = self.critic
+            self.critic_target_fwd = self.critic_target
+            self.critic_q1_fwd = self.critic.Q1
 
     def select_action(self, state_tup):
         ind_state, imm_state = state_tup
@@ -207,11 +249,13 @@ class TD3(object):
         else:
             ind_state = torch.FloatTensor(ind_state).to(device)
             imm_state = torch.FloatTensor(imm_state).to(device)
-        action = self.actor(ind_state, imm_state).cpu().data.numpy()
+        action = self.actor_fwd(ind_state, imm_state).cpu().data.numpy()
         return action
 
     def train(self, replay_buffer, batch_size=100):
         self.total_it += 1
+        scaler = self.scaler
+        use_amp = self.use_amp
         # Sample replay buffer
         (
             state,
@@ -221,54 +265,58 @@ class TD3(object):
             not_done,
         ) = replay_buffer.sample(batch_size)
 
-        with torch.no_grad():
+        with torch.inference_mode(), torch.cuda.amp.autocast(enabled=use_amp):
             # Select action according to policy
             noise = (torch.randn_like(action) * self.policy_noise).clamp(
                 -self.noise_clip, self.noise_clip
             )
             next_action = (
-                self.actor_target(next_state) + noise
+                self.actor_target_fwd(next_state) + noise
             ).clamp(-self.max_action, self.max_action)
             # Compute the target Q value
-            target_Q1, target_Q2 = self.critic_target(next_state, next_action)
+            target_Q1, target_Q2 = self.critic_target_fwd(next_state, next_action)
             target_Q = torch.min(target_Q1, target_Q2)
-            target_Q = reward + not_done * self.discount * target_Q
-        # Get current Q estimates
-        current_Q1, current_Q2 = self.critic(state, action)
-        # Compute critic loss
-        critic_loss = F.mse_loss(current_Q1, target_Q) + F.mse_loss(
-            current_Q2, target_Q
-        )
+        # combine outside inference mode so target_Q can be saved for backward
+        target_Q = reward + not_done * self.discount * target_Q.float()
+        with torch.cuda.amp.autocast(enabled=use_amp):
+            # Get current Q estimates
+            current_Q1, current_Q2 = self.critic_fwd(state, action)
+            # Compute critic loss
+            critic_loss = F.mse_loss(current_Q1, target_Q) + F.mse_loss(
+                current_Q2, target_Q
+            )
         # Optimize the critic
         self.critic_optimizer.zero_grad()
-        critic_loss.backward()
-        torch.nn.utils.clip_grad_norm_(self.critic.parameters(), 1) 
-        self.critic_optimizer.step()
+        scaler.scale(critic_loss).backward()
+        scaler.unscale_(self.critic_optimizer)
+        torch.nn.utils.clip_grad_norm_(self.critic.parameters(), 1)
+        scaler.step(self.critic_optimizer)
+        scaler.update()
 
         # Delayed policy updates
         if self.total_it % self.policy_freq == 0:
             # Compute actor losse
-            actor_loss = -self.critic.Q1(state, self.actor(state)).mean()
+            with torch.cuda.amp.autocast(enabled=use_amp):
+                actor_loss = -self.critic_q1_fwd(state, self.actor_fwd(state)).mean()
             # Optimize the actor
             self.actor_optimizer.zero_grad()
 
-            actor_loss.backward()
-            torch.nn.utils.clip_grad_norm_(self.actor.parameters(), 1) 
+            scaler.scale(actor_loss).backward()
+            scaler.unscale_(self.actor_optimizer)
+            torch.nn.utils.clip_grad_norm_(self.actor.parameters(), 1)
 
-            self.actor_optimizer.step()
+            scaler.step(self.actor_optimizer)
+            scaler.update()
             # self.actor_scheduler.step(actor_loss)
             # Update the frozen target models
-            for param, target_param in zip(
-                self.critic.parameters(), self.critic_target.parameters()
-            ):
-                target_param.data.copy_(
-                    self.tau * param.data + (1 - self.tau) * target_param.data
+            with torch.no_grad():
+                torch._foreach_mul_(self.critic_target_params, 1 - self.tau)
+                torch._foreach_add_(
+                    self.critic_target_params, self.critic_params, alpha=self.tau
                 )
-            for param, target_param in zip(
-                self.actor.parameters(), self.actor_target.parameters()
-            ):
-                target_param.data.copy_(
-                    self.tau * param.data + (1 - self.tau) * target_param.data
+                torch._foreach_mul_(self.actor_target_params, 1 - self.tau)
+                torch._foreach_add_(
+                    self.actor_target_params, self.actor_params, alpha=self.tau
                 )
     
     def save(self, filename):
@@ -282,10 +330,10 @@ class TD3(object):
         self.critic_optimizer.load_state_dict(
             torch.load(filename + "_critic_optimizer")
         )
-        self.critic_target = copy.deepcopy(self.critic)
+        self.critic_target.load_state_dict(self.critic.state_dict())
         self.actor.load_state_dict(torch.load(filename + "_actor"))
         self.actor_optimizer.load_state_dict(torch.load(filename + "_actor_optimizer"))
-        self.actor_target = copy.deepcopy(self.actor)
+        self.actor_target.load_state_dict(self.actor.state_dict())
 
 
     
@@ -296,33 +344,75 @@ class ReplayBuffer(object):
         self.max_size = max_size
         self.ptr = 0
         self.size = 0   
-        self.action = np.zeros((max_size, action_dim))
+        self.action = torch.zeros((max_size, action_dim), dtype=torch.float32)
         if type(state_dim) == tuple or type(state_dim) == list:
             full_state_dim = [max_size] + [x for x in state_dim]
         else:
-            full_state_dim = (max_size, state_dim)
-        self.state = np.zeros(full_state_dim)
-        self.next_state = np.zeros(full_state_dim)
-        self.reward = np.zeros((max_size, 1))
-        self.not_done = np.zeros((max_size, 1))
+            full_state_dim = [max_size, state_dim]
+        # empty, not zeros: rows are fully written before they can be
+        # sampled, and zeroing would commit the whole (huge) allocation
+        self.state = torch.empty(full_state_dim, dtype=torch.float32)
+        self.next_state = torch.empty(full_state_dim, dtype=torch.float32)
+        self.reward = torch.zeros((max_size, 1), dtype=torch.float32)
+        self.not_done = torch.zeros((max_size, 1), dtype=torch.float32)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.pin_memory = torch.cuda.is_available()
+        self._batch_size = None
+        self._batch_buffers = None
 
     def add(self, state, action, next_state, reward, done):
-        self.next_state[self.ptr] = next_state
-        self.action[self.ptr] = action
-        self.state[self.ptr] = state
-        self.reward[self.ptr] = reward
+        self.next_state[self.ptr] = torch.as_tensor(next_state, dtype=torch.float32)
+        self.action[self.ptr] = torch.as_tensor(action, dtype=torch.float32)
+        self.state[self.ptr] = torch.as_tensor(state, dtype=torch.float32)
+        self.reward[self.ptr] = torch.as_tensor(reward, dtype=torch.float32)
+        self.not_done[self.ptr] = 1.0 - done
+        self.ptr = (self.ptr + 1) % self.max_size
+        self.size = min(self.size + 1, self.max_size)
+
+    def add_from_state(self, state_np, action, next_state, reward, done):
+        """
+        Stores a transition without building intermediate state arrays:
+        the cached pre-step array is copied straight into its row and the
+        advanced State writes itself into the next_state row in place.
+        """
+        np.copyto(self.state[self.ptr].numpy(), state_np)
+        next_state.write_into(self.next_state[self.ptr].numpy())
+        self.action[self.ptr] = torch.as_tensor(action, dtype=torch.float32)
+        self.reward[self.ptr] = torch.as_tensor(reward, dtype=torch.float32)
         self.not_done[self.ptr] = 1.0 - done
         self.ptr = (self.ptr + 1) % self.max_size
         self.size = min(self.size + 1, self.max_size)
 
+    def _ensure_batch_buffers(self, batch_size):
+        """
+        Lazily allocates reusable device-side batch buffers so sample()
+        does not allocate five new GPU tensors every training step
+        """
+        if self._batch_size == batch_size:
+            return
+        self._batch_size = batch_size
+        self._batch_buffers = [
+            torch.empty(
+                (batch_size,) + arr.shape[1:], dtype=torch.float32, device=self.device
+            )
+            for arr in (self.state, self.action, self.next_state, self.reward, self.not_done)
+        ]
+
     def sample(self, batch_size):
-        ind = np.random.randint(0, self.size, size=batch_size)
-        return (
-            torch.FloatTensor(self.state[ind]).to(self.device),
-            torch.FloatTensor(self.action[ind]).to(self.device),
-            torch.FloatTensor(self.next_state[ind]).to(self.device),
-            torch.FloatTensor(self.reward[ind]).to(self.device),
-            torch.FloatTensor(self.not_done[ind]).to(self.device),
+        ind = torch.randint(0, self.size, (batch_size,))
+        batches = (
+            self.state.index_select(0, ind),
+            self.action.index_select(0, ind),
+            self.next_state.index_select(0, ind),
+            self.reward.index_select(0, ind),
+            self.not_done.index_select(0, ind),
         )
+        if self.device.type != "cuda":
+            return batches
+        self._ensure_batch_buffers(batch_size)
+        for buf, batch in zip(self._batch_buffers, batches):
+            if self.pin_memory:
+                batch = batch.pin_memory()
+            buf.copy_(batch, non_blocking=True)
+        return tuple(self._batch_buffers)
 
@@ -288,6 +288,12 @@ class State(object):
         """
         state= self.get_state()
         return state
+
+    def write_into(self, out):
+        """
+        Writes the state array into the preallocated array out in place
+        """
+        np.copyto(out, self.get_state())
         
     def get_state(self):
         """